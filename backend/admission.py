@@ -0,0 +1,96 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+"""
+AdmissionController
+    decides whether a request may be served. Each client gets a token
+    bucket (two numbers kept in an LRU ordered dict, so memory is O(1) per
+    active client and the least recently seen buckets are evicted first),
+    and expensive endpoints share a global concurrency cap.
+
+    An evicted bucket would have refilled to full while idle anyway, so
+    evicting idle clients never lets anyone exceed their rate.
+"""
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        rate=20.0,
+        burst=40,
+        max_clients=10000,
+        max_expensive=4,
+        expensive_endpoints=(),
+        clock=time.monotonic,
+    ):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self.max_expensive = max_expensive
+        self.expensive_endpoints = frozenset(expensive_endpoints)
+        self.clock = clock
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._expensive_in_flight = 0
+
+        self.decisions = 0
+        self.decision_ns = 0
+
+    def admit(self, client, endpoint):
+        """
+        Returns (status, retry_after). status is None when the request is
+        admitted, 429 when the client is over its rate and 503 when too many
+        expensive requests are already running. An admitted expensive
+        request must be paired with a call to release(endpoint).
+        """
+        started = time.perf_counter_ns()
+        with self._lock:
+            status, retry_after = self._take_token(client)
+            if status is None and endpoint in self.expensive_endpoints:
+                if self._expensive_in_flight >= self.max_expensive:
+                    # shed requests do not count against the client's rate
+                    self._buckets[client][0] += 1
+                    status, retry_after = 503, 1
+                else:
+                    self._expensive_in_flight += 1
+            self.decisions += 1
+            self.decision_ns += time.perf_counter_ns() - started
+        return status, retry_after
+
+    def release(self, endpoint):
+        if endpoint in self.expensive_endpoints:
+            with self._lock:
+                self._expensive_in_flight = max(0, self._expensive_in_flight - 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._buckets),
+                "expensive_in_flight": self._expensive_in_flight,
+                "decisions": self.decisions,
+                "mean_decision_us": (
+                    self.decision_ns / self.decisions / 1000 if self.decisions else 0.0
+                ),
+            }
+
+    def _take_token(self, client):
+        now = self.clock()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            return 429, max(1, math.ceil((1 - bucket[0]) / self.rate))
+
+        bucket[0] -= 1
+        return None, None
@@ -0,0 +1,67 @@
+import string
+
+# Characters stripped from answers before comparing them, matching the
+# punctuation the quiz frontend used to fold away in the browser
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+"""
+normalize_answer(text)
+    case- and punctuation-folds an answer and collapses whitespace
+"""
+
+
+def normalize_answer(text):
+    if text is None:
+        return ""
+    return " ".join(str(text).casefold().translate(_PUNCTUATION_TABLE).split())
+
+
+"""
+within_edit_distance(a, b, max_distance)
+    returns True if the Levenshtein distance between a and b is at most
+    max_distance. Only a band of width 2 * max_distance + 1 around the
+    diagonal is computed, and the scan stops as soon as every cell in a row
+    exceeds the threshold, so the cost is O(len(a) * max_distance) plus
+    allocating two rows of len(b) + 1 cells.
+"""
+
+
+def within_edit_distance(a, b, max_distance):
+    if a == b:
+        return True
+    if max_distance <= 0 or abs(len(a) - len(b)) > max_distance:
+        return False
+
+    if len(a) > len(b):
+        a, b = b, a
+
+    too_far = max_distance + 1
+    # Two rows are allocated once and reused; each row only writes its band
+    # and the cell just left of it, so cells outside the band stay too_far
+    previous_row = [too_far] * (len(b) + 1)
+    current_row = [too_far] * (len(b) + 1)
+    for column in range(min(len(b), max_distance) + 1):
+        previous_row[column] = column
+
+    for row, char_a in enumerate(a, 1):
+        low = max(1, row - max_distance)
+        high = min(len(b), row + max_distance)
+        current_row[low - 1] = row if low == 1 and row <= max_distance else too_far
+        best = current_row[low - 1]
+        for column in range(low, high + 1):
+            cost = 0 if char_a == b[column - 1] else 1
+            value = min(
+                previous_row[column] + 1,
+                current_row[column - 1] + 1,
+                previous_row[column - 1] + cost,
+            )
+            if value > max_distance:
+                value = too_far
+            current_row[column] = value
+            if value < best:
+                best = value
+        if best > max_distance:
+            return False
+        previous_row, current_row = current_row, previous_row
+
+    return previous_row[len(b)] <= max_distance
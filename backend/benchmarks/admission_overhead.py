@@ -0,0 +1,53 @@
+"""
+Measures the per-request cost of an admission decision.
+
+    python benchmarks/admission_overhead.py
+
+Runs the token-bucket and concurrency-cap decision for a mix of active
+clients (with LRU eviction kicking in) and prints the mean time per call.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdmissionController
+
+ROUNDS = 200000
+
+
+def run(active_clients, max_clients):
+    admission = AdmissionController(
+        rate=1e9,
+        burst=1e9,
+        max_clients=max_clients,
+        expensive_endpoints=["find_questions"],
+    )
+    clients = ["10.0.{}.{}".format(i // 256, i % 256) for i in range(active_clients)]
+    endpoints = ["find_questions", "find_categories"]
+
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        endpoint = endpoints[i & 1]
+        admission.admit(clients[i % active_clients], endpoint)
+        admission.release(endpoint)
+    elapsed = time.perf_counter() - started
+
+    stats = admission.stats()
+    print(
+        "{:>6} clients, cap {:>6}: {:.2f} us per admit+release "
+        "({:.2f} us measured inside admit), {} buckets kept".format(
+            active_clients,
+            max_clients,
+            elapsed / ROUNDS * 1e6,
+            stats["mean_decision_us"],
+            stats["clients"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    run(1, 10000)
+    run(1000, 10000)
+    run(50000, 10000)
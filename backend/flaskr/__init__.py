@@ -1,28 +1,164 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 import json
-from models import setup_db, Question, Category
+from models import (
+    db,
+    setup_db,
+    dispose_engine,
+    get_question_sampler,
+    search_questions,
+    find_questions_by_category,
+    find_quiz_questions,
+    find_all_categories,
+    Question,
+    Category,
+    QuestionWeight,
+)
+from answers import normalize_answer, within_edit_distance
+from admission import AdmissionController
+from group_commit import GroupCommitWriter, DURABILITY_MODES
 import os
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 QUESTIONS_PER_PAGE = 10
 
+# Admission control defaults, overridable through test_config
+RATE_LIMIT_PER_SECOND = 20
+RATE_LIMIT_BURST = 40
+RATE_LIMIT_MAX_CLIENTS = 10000
+# Endpoints that scan many rows share this many concurrent slots
+# ("find_questions:search" is find_questions with a non-empty searchTerm)
+EXPENSIVE_ENDPOINTS = ["find_questions:search"]
+EXPENSIVE_CONCURRENCY = 4
+
+# Most sub-requests accepted by one call to the batch endpoint
+MAX_BATCH_REQUESTS = 20
+
+# Typos accepted by the answer check: at most this many edits...
+ANSWER_MAX_DISTANCE = 2
+# ...and one edit per this many characters of the normalized answer
+ANSWER_CHARS_PER_EDIT = 5
+
+# Seconds between checks of whether other processes changed the questions
+# or weights the quiz sampler was loaded from
+SAMPLER_VERSION_CHECK_SECONDS = 5
+
+# Question pages requested by warm_up before a server accepts traffic
+WARM_UP_PAGES = 3
+
+# Group commit for question creation is off by default
+GROUP_COMMIT_MAX_ROWS = 64
+GROUP_COMMIT_MAX_DELAY_MS = 5
+# A request waiting for its batch gives up with 503 after this long
+GROUP_COMMIT_TIMEOUT_MS = 5000
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        ADMISSION_CONTROL=True,
+        WORKER_PROCESSES=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        RATE_LIMIT_PER_SECOND=RATE_LIMIT_PER_SECOND,
+        RATE_LIMIT_BURST=RATE_LIMIT_BURST,
+        RATE_LIMIT_MAX_CLIENTS=RATE_LIMIT_MAX_CLIENTS,
+        EXPENSIVE_ENDPOINTS=EXPENSIVE_ENDPOINTS,
+        EXPENSIVE_CONCURRENCY=EXPENSIVE_CONCURRENCY,
+        MAX_BATCH_REQUESTS=MAX_BATCH_REQUESTS,
+        ANSWER_MAX_DISTANCE=ANSWER_MAX_DISTANCE,
+        ANSWER_CHARS_PER_EDIT=ANSWER_CHARS_PER_EDIT,
+        SAMPLER_VERSION_CHECK_SECONDS=SAMPLER_VERSION_CHECK_SECONDS,
+        GROUP_COMMIT=False,
+        GROUP_COMMIT_MAX_ROWS=GROUP_COMMIT_MAX_ROWS,
+        GROUP_COMMIT_MAX_DELAY_MS=GROUP_COMMIT_MAX_DELAY_MS,
+        GROUP_COMMIT_DURABILITY="commit",
+        GROUP_COMMIT_TIMEOUT_MS=GROUP_COMMIT_TIMEOUT_MS,
+    )
+    if test_config is not None:
+        app.config.update(test_config)
     setup_db(app)
     """
     @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     """
     cors = CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
+    """
+    Optional group commit: new questions are queued to a background writer
+    that commits them in batches instead of once per request.
+    """
+
+    writer = None
+    if app.config["GROUP_COMMIT"]:
+        if app.config["GROUP_COMMIT_DURABILITY"] not in DURABILITY_MODES:
+            raise ValueError(
+                "GROUP_COMMIT_DURABILITY must be one of {}".format(DURABILITY_MODES)
+            )
+        writer = GroupCommitWriter(
+            app,
+            max_rows=app.config["GROUP_COMMIT_MAX_ROWS"],
+            max_delay=app.config["GROUP_COMMIT_MAX_DELAY_MS"] / 1000,
+        )
+    app.extensions["group_commit"] = writer
+    app.extensions["warm_up"] = {"ready": False, "seconds": None}
+
     """
     @DONE: Use the after_request decorator to set Access-Control-Allow
     """
 
+    """
+    Admission control: per-client token buckets and a concurrency cap on
+    expensive endpoints. Rejected requests get 429 or 503 with Retry-After.
+    """
+
+    # Each worker process has its own controller, so the limits are split
+    # between WORKER_PROCESSES workers to keep the totals near the settings
+    workers = max(1, app.config["WORKER_PROCESSES"])
+    admission = AdmissionController(
+        rate=app.config["RATE_LIMIT_PER_SECOND"] / workers,
+        burst=max(1, app.config["RATE_LIMIT_BURST"] // workers),
+        max_clients=app.config["RATE_LIMIT_MAX_CLIENTS"],
+        # a cap of 0 (shed every expensive request) is kept as is
+        max_expensive=max(
+            min(1, app.config["EXPENSIVE_CONCURRENCY"]),
+            app.config["EXPENSIVE_CONCURRENCY"] // workers,
+        ),
+        expensive_endpoints=app.config["EXPENSIVE_ENDPOINTS"],
+    )
+    app.extensions["admission"] = admission
+
+    @app.before_request
+    def admit_request():
+        if not app.config["ADMISSION_CONTROL"] or request.method == "OPTIONS":
+            return
+
+        # health checks and warm-up requests are never throttled
+        if request.endpoint == "check_readiness" or request.environ.get(
+            "trivia.warm_up"
+        ):
+            return
+
+        # only searches scan the table, plain question pages are cheap
+        endpoint = request.endpoint
+        if endpoint == "find_questions" and request.args.get("searchTerm"):
+            endpoint = "find_questions:search"
+
+        # kept on the request rather than g, which batched sub-requests share
+        status, retry_after = admission.admit(request.remote_addr, endpoint)
+        if status is not None:
+            request.environ["trivia.retry_after"] = retry_after
+            abort(status)
+        request.environ["trivia.admitted_endpoint"] = endpoint
+
+    @app.teardown_request
+    def release_request(error=None):
+        endpoint = request.environ.pop("trivia.admitted_endpoint", None)
+        if endpoint is not None:
+            admission.release(endpoint)
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -37,10 +173,34 @@ def create_app(test_config=None):
     def index():
         return jsonify({"success": True, "message": "Welcome to Trivia-API"})
 
+    """
+    Readiness check for load balancers: 503 until warm_up has run
+    """
+
+    @app.route("/api/v1/ready")
+    def check_readiness():
+        status = app.extensions["warm_up"]
+        return (
+            jsonify(
+                {
+                    "success": status["ready"],
+                    "ready": status["ready"],
+                    "warm_up_seconds": status["seconds"],
+                }
+            ),
+            200 if status["ready"] else 503,
+        )
+
     """
     DONE: Create an endpoint to handle GET requests for all available categories.
     """
 
+    def get_categories():
+        # looked up once per app context, so batched sub-requests share it
+        if "categories" not in g:
+            g.categories = find_all_categories()
+        return g.categories
+
     def conv_categories_list_to_dict(categories):
         returned_categories = {}
         for category in categories:
@@ -52,7 +212,7 @@ def create_app(test_config=None):
         page = request.args.get("page", 1, type=int)
 
         try:
-            list_of_categories = Category.query.all()
+            list_of_categories = get_categories()
         except:
             abort(500)
 
@@ -98,9 +258,7 @@ def create_app(test_config=None):
         search_term = request.args.get("searchTerm", "", type=str)
 
         try:
-            list_of_questions = Question.query.filter(
-                Question.question.like("%{}%".format(search_term))
-            ).all()
+            list_of_questions = search_questions(search_term)
         except:
             abort(500)
 
@@ -115,7 +273,7 @@ def create_app(test_config=None):
             returned_questions.append(question.format())
 
         try:
-            list_of_categories = Category.query.all()
+            list_of_categories = get_categories()
         except:
             abort(500)
 
@@ -179,10 +337,21 @@ def create_app(test_config=None):
 
         try:
             new_question = Question(question, answer, category, difficulty)
-            new_question.insert()
+            if writer is None:
+                new_question.insert()
+                return jsonify({"success": True})
+            future = writer.submit(new_question)
         except:
             abort(500)
 
+        if app.config["GROUP_COMMIT_DURABILITY"] == "commit":
+            try:
+                future.result(timeout=app.config["GROUP_COMMIT_TIMEOUT_MS"] / 1000)
+            except FutureTimeoutError:
+                abort(503)
+            except:
+                abort(500)
+
         return jsonify({"success": True})
 
     """
@@ -199,9 +368,7 @@ def create_app(test_config=None):
         page = request.args.get("page", 1, type=int)
 
         try:
-            list_of_questions = Question.query.filter(
-                Question.category == category_id
-            ).all()
+            list_of_questions = find_questions_by_category(category_id)
         except:
             abort(500)
 
@@ -236,12 +403,62 @@ def create_app(test_config=None):
     and shown whether they were correct or not. 
     """
 
+    """
+    Quizzes that pass a difficulty range, a difficulty curve or ask for
+    weighted draws are served from the in-memory question sampler, which
+    keeps per-category alias tables instead of scanning the table.
+    """
+
+    def is_difficulty(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def sample_a_question(
+        previous_questions, category, difficulty_range, difficulty_curve, weighted
+    ):
+        sampler = get_question_sampler(app.config["SAMPLER_VERSION_CHECK_SECONDS"])
+        if difficulty_range is not None:
+            difficulty_range = (difficulty_range["min"], difficulty_range["max"])
+
+        while True:
+            if difficulty_curve is not None:
+                question_id = sampler.draw_along_curve(
+                    difficulty_curve,
+                    len(previous_questions),
+                    category,
+                    previous_questions,
+                    weighted,
+                )
+            else:
+                question_id = sampler.draw(
+                    category, difficulty_range, previous_questions, weighted
+                )
+
+            if question_id is None:
+                return None
+
+            question = Question.query.get(question_id)
+            if question is None:
+                # deleted by another process, drop it and draw again
+                sampler.remove(question_id)
+                continue
+
+            if sampler.key_of(question_id) != (question.category, question.difficulty):
+                # moved by another process, file it correctly and draw again
+                sampler.add(question_id, question.category, question.difficulty)
+                continue
+
+            return question
+
     @app.route("/api/v1/quizzes", methods=["POST"])
     def get_a_random_question():
         try:
             body = request.get_json()
             previous_questions = body.get("previous_questions")
             quiz_category = body.get("quiz_category")
+            include_answer = body.get("include_answer", True)
+            difficulty_range = body.get("difficulty")
+            difficulty_curve = body.get("difficulty_curve")
+            weighted = body.get("weighted", False)
         except:
             abort(422)
 
@@ -251,28 +468,215 @@ def create_app(test_config=None):
         if quiz_category is None:
             abort(422)
 
+        if difficulty_range is not None and (
+            not isinstance(difficulty_range, dict)
+            or not is_difficulty(difficulty_range.get("min"))
+            or not is_difficulty(difficulty_range.get("max"))
+            or difficulty_range["min"] > difficulty_range["max"]
+        ):
+            abort(422)
+
+        if difficulty_curve is not None and (
+            not isinstance(difficulty_curve, list)
+            or difficulty_curve == []
+            or not all(is_difficulty(value) for value in difficulty_curve)
+        ):
+            abort(422)
+
+        if difficulty_range is None and difficulty_curve is None and not weighted:
+            try:
+                list_of_questions = find_quiz_questions(
+                    quiz_category["id"], previous_questions
+                )
+
+                if list_of_questions == []:
+                    return jsonify({"success": True})
+
+                returned_question = list_of_questions[
+                    random.randint(0, len(list_of_questions) - 1)
+                ].format(include_answer=bool(include_answer))
+            except:
+                abort(500)
+
+            return jsonify(
+                {
+                    "success": True,
+                    "question": returned_question,
+                }
+            )
+
         try:
-            list_of_questions = Question.query.filter(
-                Question.id not in previous_questions,
-                Question.category == quiz_category["id"],
-            ).all()
+            # category 0 is "ALL" in the quiz view
+            category = int(quiz_category["id"]) or None
+        except:
+            abort(422)
 
-            if list_of_questions == []:
-                return jsonify({"success": True})
+        try:
+            question = sample_a_question(
+                previous_questions,
+                category,
+                difficulty_range,
+                difficulty_curve,
+                bool(weighted),
+            )
+        except:
+            abort(500)
+
+        if question is None:
+            return jsonify({"success": True})
+
+        return jsonify(
+            {
+                "success": True,
+                "question": question.format(include_answer=bool(include_answer)),
+            }
+        )
 
-            returned_question = list_of_questions[
-                random.randint(0, len(list_of_questions) - 1)
-            ].format()
+    """
+    Set per-question sampling weights used by weighted quizzes, e.g. to
+    favour questions that have been served less often. Weights default to 1
+    and are stored in the database, so every worker process sees them.
+    """
+
+    @app.route("/api/v1/quizzes/weights", methods=["POST"])
+    def set_question_weights():
+        try:
+            body = request.get_json()
+            weights = body.get("weights")
+            weights = {
+                int(question_id): float(weight)
+                for question_id, weight in weights.items()
+            }
+        except:
+            abort(422)
+
+        if not all(0 < weight < float("inf") for weight in weights.values()):
+            abort(422)
+
+        try:
+            QuestionWeight.set_weights(weights)
+        except:
+            abort(500)
+
+        return jsonify({"success": True, "updated": len(weights)})
+
+    """
+    Check a submitted answer on the server against the question's cached
+    normalized answer, so quiz payloads do not need to ship the answer.
+    Typos are tolerated up to ANSWER_MAX_DISTANCE edits, and one edit per
+    ANSWER_CHARS_PER_EDIT characters of the answer.
+    """
+
+    @app.route("/api/v1/quizzes/answer", methods=["POST"])
+    def check_an_answer():
+        try:
+            body = request.get_json()
+            question_id = body.get("question_id")
+            answer = body.get("answer")
+        except:
+            abort(422)
+
+        if (
+            not isinstance(question_id, int)
+            or isinstance(question_id, bool)
+            or not isinstance(answer, str)
+        ):
+            abort(422)
+
+        try:
+            question = Question.query.get(question_id)
         except:
             abort(500)
 
+        if question is None:
+            abort(404)
+
+        expected_answer = question.normalized_answer()
+        max_distance = min(
+            app.config["ANSWER_MAX_DISTANCE"],
+            len(expected_answer) // app.config["ANSWER_CHARS_PER_EDIT"],
+        )
+        correct = within_edit_distance(
+            normalize_answer(answer), expected_answer, max_distance
+        )
+
         return jsonify(
             {
                 "success": True,
-                "question": returned_question,
+                "question_id": question.id,
+                "correct": correct,
+                "answer": question.answer,
             }
         )
 
+    """
+    Run several API requests in one round-trip. Sub-requests are dispatched
+    in-process, in order, inside this request's app context, so they share
+    one database session and the category lookup.
+    """
+
+    def sub_request_context(sub_request):
+        return app.test_request_context(
+            sub_request["path"],
+            method=sub_request.get("method", "GET").upper(),
+            json=sub_request.get("body"),
+            environ_base={"REMOTE_ADDR": request.remote_addr},
+        )
+
+    def is_valid_sub_request(sub_request):
+        if not isinstance(sub_request, dict):
+            return False
+        method = sub_request.get("method", "GET")
+        path = sub_request.get("path")
+        if not (
+            isinstance(method, str)
+            and isinstance(path, str)
+            and path.startswith("/api/v1/")
+        ):
+            return False
+
+        # batches must not nest: route the path the way dispatch will, so
+        # escaped or decorated paths cannot hide the batch endpoint
+        with sub_request_context(sub_request):
+            return request.endpoint != "run_batch"
+
+    def dispatch_sub_request(sub_request):
+        with sub_request_context(sub_request):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as error:
+                db.session.rollback()
+                response = app.handle_exception(error)
+
+        # The session outlives the sub-request, so a failed write must not
+        # leave it waiting for a rollback the app-context teardown would do
+        if response.status_code >= 500:
+            db.session.rollback()
+
+        return {"status": response.status_code, "body": response.get_json()}
+
+    @app.route("/api/v1/batch", methods=["POST"])
+    def run_batch():
+        try:
+            body = request.get_json()
+            sub_requests = body.get("requests")
+        except:
+            abort(422)
+
+        if (
+            not isinstance(sub_requests, list)
+            or sub_requests == []
+            or len(sub_requests) > app.config["MAX_BATCH_REQUESTS"]
+            or not all(
+                is_valid_sub_request(sub_request) for sub_request in sub_requests
+            )
+        ):
+            abort(422)
+
+        responses = [dispatch_sub_request(sub_request) for sub_request in sub_requests]
+
+        return jsonify({"success": True, "responses": responses})
+
     """
     @DONE: 
     Create error handlers for all expected errors 
@@ -295,6 +699,26 @@ def create_app(test_config=None):
             422,
         )
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify(
+            {"success": False, "error": 429, "message": "too many requests"}
+        )
+        response.headers["Retry-After"] = str(
+            request.environ.get("trivia.retry_after", 1)
+        )
+        return response, 429
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        response = jsonify(
+            {"success": False, "error": 503, "message": "service unavailable"}
+        )
+        response.headers["Retry-After"] = str(
+            request.environ.get("trivia.retry_after", 1)
+        )
+        return response, 503
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return (
@@ -305,3 +729,50 @@ def create_app(test_config=None):
         )
 
     return app
+
+
+"""
+warm_up(app)
+    primes a freshly created app before it accepts traffic: loads the quiz
+    sampler and normalized answers, then requests the categories and the
+    first question pages so baked queries are compiled and mappers are
+    configured. These requests bypass admission control, and a RuntimeError
+    is raised if one fails. The database connections it opened are disposed
+    so the app can be forked safely. Afterwards /api/v1/ready reports ready.
+"""
+
+
+def warm_up(app, pages=WARM_UP_PAGES):
+    started = time.perf_counter()
+
+    with app.app_context():
+        get_question_sampler()
+        for question in search_questions(""):
+            question.normalized_answer()
+
+    client = app.test_client()
+    warm_up_environ = {"REMOTE_ADDR": "warm-up", "trivia.warm_up": True}
+
+    def get(path, expected_statuses=(200,)):
+        res = client.get(path, environ_base=warm_up_environ)
+        if res.status_code not in expected_statuses:
+            raise RuntimeError(
+                "warm-up request {} returned {}".format(path, res.status_code)
+            )
+        return res.status_code
+
+    get("/api/v1/categories")
+    for page in range(1, pages + 1):
+        # a 404 means there are fewer pages of questions
+        if get("/api/v1/questions?page={}".format(page), (200, 404)) == 404:
+            break
+
+    dispose_engine(app)
+    app.extensions["warm_up"].update(
+        ready=True, seconds=round(time.perf_counter() - started, 3)
+    )
+    return app
+
+
+def create_warm_app(test_config=None):
+    return warm_up(create_app(test_config))
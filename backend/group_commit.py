@@ -0,0 +1,135 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from models import db, Question
+
+# Durability modes for queued writes
+#   "commit":  the request waits until the batch holding its row commits
+#   "enqueue": the request returns as soon as the row is queued; rows still
+#              in the queue are lost if the process dies, and rows that
+#              later fail to insert (e.g. an unknown category) are only
+#              logged, after the request has already reported success
+DURABILITY_MODES = ("commit", "enqueue")
+
+"""
+GroupCommitWriter
+    queues new questions and inserts them from one background thread,
+    committing up to max_rows rows per transaction. A batch is flushed when
+    it is full or max_delay seconds after its first row arrived, whichever
+    comes first, so a burst of creates costs one commit (and one fsync)
+    per batch instead of one per request.
+
+    The thread is started by the first submit in each process, so an app
+    created before a fork (gunicorn preload_app) gets a writer per worker.
+"""
+
+
+class GroupCommitWriter:
+    def __init__(self, app, max_rows=64, max_delay=0.005):
+        self.app = app
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def submit(self, question):
+        """
+        Queues a question and returns a Future resolved with its id once the
+        batch holding it commits.
+        """
+        if self._closed:
+            raise RuntimeError("group commit writer is closed")
+        self._ensure_started()
+        future = Future()
+        self._queue.put((question, future))
+        return future
+
+    def close(self):
+        # Commit whatever is still queued, then stop the writer thread
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid == os.getpid() and self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _ensure_started(self):
+        # threads do not survive a fork, so a new process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,), name="group-commit-writer"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def _run(self, items):
+        while True:
+            first = items.get()
+            if first is None:
+                return
+
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = items.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self._commit(batch)
+            except Exception as error:
+                # never leave a request waiting on a batch that blew up
+                self.app.logger.exception("group commit batch failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        with self.app.app_context():
+            try:
+                question_ids = Question.insert_all([question for question, _ in batch])
+            except Exception:
+                db.session.rollback()
+                # Retry row by row so one bad row does not fail its batch
+                for question, future in batch:
+                    self._commit_one(question, future)
+                return
+
+        for question_id, (_, future) in zip(question_ids, batch):
+            future.set_result(question_id)
+
+    def _commit_one(self, question, future):
+        try:
+            question_id = Question.insert_all([question])[0]
+        except Exception as error:
+            db.session.rollback()
+            self.app.logger.error("group commit could not insert a question: %s", error)
+            future.set_exception(error)
+        else:
+            future.set_result(question_id)
@@ -0,0 +1,44 @@
+# Multi-process serving: gunicorn --config gunicorn.conf.py
+#
+# The app is created and warmed up once in the master process, then forked
+# into WEB_CONCURRENCY workers (one per CPU by default), each serving up to
+# WEB_THREADS requests at once. Each worker drops the database connections
+# it inherited before serving.
+import multiprocessing
+import os
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", "5000"))
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# create_app reads it to split the per-process rate limits between workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Threads of one worker share its admission controller and group-commit
+# writer; with sync workers (WEB_THREADS=1) a worker never runs two
+# requests at once, so neither the expensive-request cap nor group commit
+# would ever see concurrent requests
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+wsgi_app = "flaskr:create_app()"
+preload_app = True
+
+
+def when_ready(server):
+    # runs in the master once the app is preloaded, before any worker forks
+    if server.cfg.preload_app:
+        from flaskr import warm_up
+
+        warm_up(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from models import dispose_engine
+
+        dispose_engine(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    # without preloading every worker creates and warms its own app
+    if not worker.cfg.preload_app:
+        from flaskr import warm_up
+
+        warm_up(worker.wsgi)
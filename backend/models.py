@@ -1,8 +1,12 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import time
+from sqlalchemy import Column, String, Integer, Float, create_engine, bindparam, func
+from sqlalchemy.ext import baked
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import json
+from answers import normalize_answer
+from sampling import QuestionSampler
 
 database_name = "trivia"
 # ! We need both username and password to connect to the database
@@ -15,6 +19,20 @@ database_path = "postgres://{}:{}@{}/{}".format(
 )
 db = SQLAlchemy()
 
+# Queries on hot endpoints are baked: each is built and compiled to SQL once
+# per process, then reused with new bound parameters on every request. They
+# run on db.session(), the Session itself, not the scoped_session proxy.
+bakery = baked.bakery()
+
+# question id -> (answer, normalized answer), filled lazily and refreshed on
+# writes. The raw answer is kept so entries made stale by another process
+# are detected and recomputed.
+normalized_answers = {}
+
+# per-category quiz sampling tables, loaded on first use, kept in step with
+# this process's writes and reloaded when the database version moves on
+question_sampler = QuestionSampler()
+
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -30,6 +48,102 @@ def setup_db(app, database_path=database_path):
     db.create_all()
 
 
+"""
+dispose_engine(app)
+    closes the app's pooled database connections. Call it in the parent
+    before forking workers and in each worker after the fork, so no process
+    uses a connection opened by another.
+"""
+
+
+def dispose_engine(app):
+    db.get_engine(app).dispose()
+
+
+"""
+get_question_sampler(max_age)
+    returns the quiz sampler, reloading it from the database when another
+    process has changed the questions or weights. The version checked is
+    (question count, max question id, (weight row count, max weight row id)),
+    read with one query; weight rows get a new id on every change.
+
+    The version query aggregates both tables, so it runs at most once every
+    max_age seconds. In between, this process's own writes still reach the
+    sampler at once, but questions added or reweighted elsewhere can be
+    missed for up to max_age seconds.
+"""
+
+
+def get_sampler_version():
+    query = bakery(
+        lambda session: session.query(
+            session.query(func.count(Question.id)).as_scalar(),
+            session.query(func.max(Question.id)).as_scalar(),
+            session.query(func.count(QuestionWeight.id)).as_scalar(),
+            session.query(func.max(QuestionWeight.id)).as_scalar(),
+        )
+    )
+    count, max_id, weight_count, max_weight_id = query(db.session()).one()
+    return (count, max_id, (weight_count, max_weight_id))
+
+
+def get_question_sampler(max_age=0):
+    now = time.monotonic()
+    if (
+        question_sampler.version is not None
+        and now - question_sampler.checked_at < max_age
+    ):
+        return question_sampler
+
+    version = get_sampler_version()
+    if not question_sampler.loaded or question_sampler.version != version:
+        question_sampler.load(
+            db.session.query(Question.id, Question.category, Question.difficulty).all(),
+            db.session.query(QuestionWeight.question_id, QuestionWeight.weight).all(),
+            version,
+        )
+    question_sampler.checked_at = now
+    return question_sampler
+
+
+"""
+Baked queries for the hot endpoints
+"""
+
+
+def search_questions(search_term):
+    query = bakery(lambda session: session.query(Question))
+    query += lambda q: q.filter(Question.question.like(bindparam("pattern")))
+    query += lambda q: q.order_by(Question.id)
+    return query(db.session()).params(pattern="%{}%".format(search_term)).all()
+
+
+def find_questions_by_category(category_id):
+    query = bakery(lambda session: session.query(Question))
+    query += lambda q: q.filter(Question.category == bindparam("category_id"))
+    query += lambda q: q.order_by(Question.id)
+    return query(db.session()).params(category_id=category_id).all()
+
+
+def find_quiz_questions(category_id, previous_questions):
+    query = bakery(lambda session: session.query(Question))
+    query += lambda q: q.filter(
+        ~Question.id.in_(bindparam("previous_questions", expanding=True)),
+        Question.category == bindparam("category_id"),
+    )
+    return (
+        query(db.session())
+        .params(category_id=category_id, previous_questions=previous_questions)
+        .all()
+    )
+
+
+def find_all_categories():
+    query = bakery(lambda session: session.query(Category))
+    query += lambda q: q.order_by(Category.id)
+    return query(db.session()).all()
+
+
 """
 Question
 
@@ -54,22 +168,54 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        normalized_answers[self.id] = (self.answer, normalize_answer(self.answer))
+        question_sampler.insert(self.id, self.category, self.difficulty)
+
+    @staticmethod
+    def insert_all(questions):
+        # Insert several questions in one transaction and return their ids.
+        # Ids are read after the flush so the expired rows are not reloaded.
+        db.session.add_all(questions)
+        db.session.flush()
+        rows = [
+            (question.id, question.answer, question.category, question.difficulty)
+            for question in questions
+        ]
+        db.session.commit()
+        for question_id, answer, category, difficulty in rows:
+            normalized_answers[question_id] = (answer, normalize_answer(answer))
+            question_sampler.insert(question_id, category, difficulty)
+        return [row[0] for row in rows]
 
     def update(self):
         db.session.commit()
+        normalized_answers[self.id] = (self.answer, normalize_answer(self.answer))
+        question_sampler.add(self.id, self.category, self.difficulty)
 
     def delete(self):
+        question_id = self.id
         db.session.delete(self)
         db.session.commit()
+        normalized_answers.pop(question_id, None)
+        question_sampler.remove(question_id)
 
-    def format(self):
-        return {
+    def normalized_answer(self):
+        cached = normalized_answers.get(self.id)
+        if cached is None or cached[0] != self.answer:
+            cached = (self.answer, normalize_answer(self.answer))
+            normalized_answers[self.id] = cached
+        return cached[1]
+
+    def format(self, include_answer=True):
+        formatted_question = {
             "id": self.id,
             "question": self.question,
-            "answer": self.answer,
             "category": self.category,
             "difficulty": self.difficulty,
         }
+        if include_answer:
+            formatted_question["answer"] = self.answer
+        return formatted_question
 
 
 """
@@ -100,3 +246,40 @@ class Category(db.Model):
 
     def format(self):
         return {"id": self.id, "type": self.type}
+
+
+"""
+QuestionWeight
+    sampling weight of a question for weighted quizzes. A changed weight is
+    stored as a new row, so max(id) moves on with every change and other
+    processes notice it (see get_question_sampler).
+"""
+
+
+class QuestionWeight(db.Model):
+    __tablename__ = "question_weights"
+
+    id = Column(Integer, primary_key=True)
+    question_id = Column(Integer, unique=True, nullable=False)
+    weight = Column(Float, nullable=False)
+
+    def __init__(self, question_id, weight):
+        self.question_id = question_id
+        self.weight = weight
+
+    @staticmethod
+    def set_weights(weights):
+        db.session.query(QuestionWeight).filter(
+            QuestionWeight.question_id.in_(list(weights))
+        ).delete(synchronize_session=False)
+        db.session.add_all(
+            [
+                QuestionWeight(question_id, weight)
+                for question_id, weight in weights.items()
+            ]
+        )
+        db.session.commit()
+        question_sampler.invalidate()
+
+    def format(self):
+        return {"question_id": self.question_id, "weight": self.weight}
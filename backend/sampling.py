@@ -0,0 +1,257 @@
+import random
+import threading
+
+# Weighted draws that keep hitting excluded questions fall back to a scan
+# after this many attempts
+MAX_DRAW_ATTEMPTS = 32
+
+"""
+build_alias_table(weights)
+    builds a Walker alias table (Vose's method) so that a weighted index
+    can be drawn in O(1) with draw_from_alias_table
+"""
+
+
+def build_alias_table(weights):
+    count = len(weights)
+    total = float(sum(weights))
+    probabilities = [0.0] * count
+    aliases = [0] * count
+    scaled = [weight * count / total for weight in weights]
+
+    small = [index for index, value in enumerate(scaled) if value < 1]
+    large = [index for index, value in enumerate(scaled) if value >= 1]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] = scaled[more] + scaled[less] - 1
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+    for index in small + large:
+        probabilities[index] = 1.0
+
+    return probabilities, aliases
+
+
+def draw_from_alias_table(probabilities, aliases, rng=random):
+    index = rng.randrange(len(probabilities))
+    if rng.random() < probabilities[index]:
+        return index
+    return aliases[index]
+
+
+"""
+_Bucket
+    the questions of one (category, difficulty) pair. Ids live in an array
+    with an index map so inserts and deletes are O(1); the alias table over
+    their weights is rebuilt lazily, for this bucket only, on the first
+    weighted draw after a change.
+"""
+
+
+class _Bucket:
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self.alias_table = None
+        self.total_weight = 0.0
+
+    def add(self, question_id):
+        if question_id in self.positions:
+            return
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+        self.alias_table = None
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last_id = self.ids.pop()
+        if last_id != question_id:
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+        self.alias_table = None
+
+    def prepare(self, weights):
+        if self.alias_table is None:
+            bucket_weights = [weights.get(question_id, 1.0) for question_id in self.ids]
+            self.total_weight = sum(bucket_weights)
+            self.alias_table = build_alias_table(bucket_weights)
+
+    def draw(self, weighted, rng):
+        if weighted:
+            return self.ids[draw_from_alias_table(*self.alias_table, rng=rng)]
+        return self.ids[rng.randrange(len(self.ids))]
+
+
+"""
+QuestionSampler
+    draws quiz questions by category and difficulty, either uniformly or
+    by per-question weight (default 1.0). A category of None draws across
+    all categories.
+
+    version identifies the database state the sampler reflects (see
+    models.get_question_sampler), and checked_at is when it was last compared
+    with the database. Inserts made through this sampler advance it; changes
+    it cannot account for reset it to None, forcing a reload.
+"""
+
+
+class QuestionSampler:
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.loaded = False
+        self.version = None
+        self.checked_at = 0.0
+        self._buckets = {}
+        self._keys = {}
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows, weights, version):
+        # rows are (id, category, difficulty) tuples, weights maps id to weight
+        with self._lock:
+            self._buckets = {}
+            self._keys = {}
+            self._weights = dict(weights)
+            for question_id, category, difficulty in rows:
+                self._add(question_id, category, difficulty)
+            self.version = version
+            self.loaded = True
+
+    def insert(self, question_id, category, difficulty):
+        # a new row: (count, max id) advance the way the database's did
+        with self._lock:
+            self._remove(question_id)
+            self._add(question_id, category, difficulty)
+            if self.version is not None:
+                count, max_id, weight_version = self.version
+                self.version = (
+                    count + 1,
+                    max(max_id or 0, question_id),
+                    weight_version,
+                )
+
+    def add(self, question_id, category, difficulty):
+        # an existing row that may have moved to another bucket
+        with self._lock:
+            self._remove(question_id)
+            self._add(question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self._lock:
+            if question_id in self._keys and self.version is not None:
+                count, max_id, weight_version = self.version
+                # the new max id is unknown if the max row was deleted
+                self.version = (
+                    None
+                    if question_id == max_id
+                    else (count - 1, max_id, weight_version)
+                )
+            self._remove(question_id)
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+
+    def key_of(self, question_id):
+        with self._lock:
+            return self._keys.get(question_id)
+
+    def difficulties(self, category=None):
+        with self._lock:
+            return sorted(
+                {
+                    difficulty
+                    for (bucket_category, difficulty), bucket in self._buckets.items()
+                    if bucket.ids
+                    and category in (None, bucket_category)
+                    and difficulty is not None
+                }
+            )
+
+    def draw(self, category=None, difficulty_range=None, exclude=(), weighted=False):
+        """
+        Returns a question id in the category whose difficulty lies in the
+        inclusive (min, max) difficulty_range (any difficulty if None) and
+        that is not in exclude, or None.
+        """
+        exclude = set(exclude)
+        with self._lock:
+            buckets = [
+                bucket
+                for (bucket_category, difficulty), bucket in self._buckets.items()
+                if bucket.ids
+                and category in (None, bucket_category)
+                and (
+                    difficulty_range is None
+                    or difficulty is not None
+                    and difficulty_range[0] <= difficulty <= difficulty_range[1]
+                )
+            ]
+            if not buckets:
+                return None
+
+            if weighted:
+                for bucket in buckets:
+                    bucket.prepare(self._weights)
+                bucket_weights = [bucket.total_weight for bucket in buckets]
+            else:
+                bucket_weights = [len(bucket.ids) for bucket in buckets]
+
+            for _ in range(MAX_DRAW_ATTEMPTS):
+                bucket = self.rng.choices(buckets, weights=bucket_weights)[0]
+                question_id = bucket.draw(weighted, self.rng)
+                if question_id not in exclude:
+                    return question_id
+
+            candidates = [
+                question_id
+                for bucket in buckets
+                for question_id in bucket.ids
+                if question_id not in exclude
+            ]
+            if not candidates:
+                return None
+            if not weighted:
+                return self.rng.choice(candidates)
+            candidate_weights = [
+                self._weights.get(question_id, 1.0) for question_id in candidates
+            ]
+            return self.rng.choices(candidates, weights=candidate_weights)[0]
+
+    def draw_along_curve(
+        self, curve, position, category=None, exclude=(), weighted=False
+    ):
+        """
+        Draws at the curve's target difficulty for this quiz position,
+        falling back to the nearest difficulties that still have questions.
+        """
+        target = curve[min(position, len(curve) - 1)]
+        for difficulty in sorted(
+            self.difficulties(category), key=lambda value: (abs(value - target), value)
+        ):
+            question_id = self.draw(
+                category, (difficulty, difficulty), exclude, weighted
+            )
+            if question_id is not None:
+                return question_id
+        return None
+
+    def _add(self, question_id, category, difficulty):
+        key = (category, difficulty)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        bucket.add(question_id)
+        self._keys[question_id] = key
+
+    def _remove(self, question_id):
+        key = self._keys.pop(question_id, None)
+        if key is not None:
+            self._buckets[key].remove(question_id)
@@ -0,0 +1,2 @@
+export FLASK_APP=flaskr
+gunicorn --config gunicorn.conf.py
@@ -1,3 +1,3 @@
 export FLASK_APP=flaskr
 export FLASK_ENV=development
-waitress-serve --cal --listen=*:5000 'flaskr:create_app'
\ No newline at end of file
+waitress-serve --cal --listen=*:5000 'flaskr:create_warm_app'
\ No newline at end of file
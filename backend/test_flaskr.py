@@ -2,8 +2,11 @@ import os
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
-from flaskr import create_app
-from models import setup_db, Question, Category
+from sqlalchemy import event
+from flaskr import create_app, warm_up
+from models import setup_db, db, normalized_answers, Question, Category, QuestionWeight
+from admission import AdmissionController
+from answers import normalize_answer
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -26,6 +29,12 @@ class TriviaTestCase(unittest.TestCase):
             # create all tables
             self.db.create_all()
 
+    def create_test_app(self, test_config):
+        """Create an app with extra settings, bound to the test database."""
+        app = create_app(test_config)
+        setup_db(app, self.database_path)
+        return app
+
     def tearDown(self):
         """Executed after reach test"""
         pass
@@ -103,6 +112,160 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["question"]["id"] in previous_questions, False)
         self.assertEqual(data["question"]["category"], category_id)
 
+    def test_get_a_quiz_question_in_difficulty_range(self):
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 0},
+                "difficulty": {"min": 2, "max": 3},
+                "weighted": True,
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["difficulty"] in [2, 3], True)
+
+        # A huge range is compared against the difficulties, not expanded
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 0},
+                "difficulty": {"min": 0, "max": 10 ** 10},
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual("question" in data, True)
+
+    def test_get_a_quiz_question_along_difficulty_curve(self):
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 1},
+                "difficulty_curve": [1, 2, 3, 4, 5],
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["category"], 1)
+
+    def test_set_question_weights(self):
+        res = self.client().get("/api/v1/categories/1/questions")
+        question_ids = [
+            question["id"] for question in json.loads(res.data)["questions"]
+        ]
+
+        res = self.client().post(
+            "/api/v1/quizzes/weights",
+            json={"weights": {str(question_ids[0]): 1000000}},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["updated"], 1)
+
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": question_ids[1:],
+                "quiz_category": {"id": 1},
+                "weighted": True,
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], question_ids[0])
+
+        res = self.client().post(
+            "/api/v1/quizzes/weights",
+            json={"weights": {str(question_ids[0]): 0}},
+        )
+        self.assertEqual(res.status_code, 422)
+
+        # weights are stored in the database, visible to every process
+        with self.app.app_context():
+            weight = QuestionWeight.query.filter(
+                QuestionWeight.question_id == question_ids[0]
+            ).one()
+            self.assertEqual(weight.weight, 1000000)
+            db.session.delete(weight)
+            db.session.commit()
+
+    def test_quiz_sampler_sees_questions_added_by_other_processes(self):
+        app = self.create_test_app({"SAMPLER_VERSION_CHECK_SECONDS": 0})
+        client = app.test_client()
+
+        res = client.post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 1},
+                "weighted": True,
+            },
+        )
+        self.assertEqual(res.status_code, 200)
+
+        # written the way another worker or psql would, bypassing this
+        # process's sampler
+        with self.app.app_context():
+            other_ids = [question.id for question in Question.query.all()]
+            db.session.execute(
+                "INSERT INTO questions (question, answer, difficulty, category) "
+                "VALUES ('Which planet is the largest?', 'Jupiter', 5, 1)"
+            )
+            db.session.commit()
+            new_id = db.session.execute("SELECT max(id) FROM questions").scalar()
+
+        res = client.post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": other_ids,
+                "quiz_category": {"id": 1},
+                "difficulty": {"min": 5, "max": 5},
+            },
+        )
+        data = json.loads(res.data)
+        client.delete("/api/v1/questions/{}".format(new_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], new_id)
+
+    def test_quiz_sampler_checks_the_database_version_once_per_interval(self):
+        app = self.create_test_app({"SAMPLER_VERSION_CHECK_SECONDS": 60})
+        client = app.test_client()
+        quiz = {"previous_questions": [], "quiz_category": {"id": 0}, "weighted": True}
+
+        res = client.post("/api/v1/quizzes", json=quiz)
+        self.assertEqual(res.status_code, 200)
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement.lower())
+
+        with app.app_context():
+            engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            for _ in range(3):
+                res = client.post("/api/v1/quizzes", json=quiz)
+                self.assertEqual(res.status_code, 200)
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+        self.assertEqual(len(statements) > 0, True)
+        self.assertEqual(any("count(" in statement for statement in statements), False)
+
     def test_422_send_invalid_filter_for_quiz_question(self):
         # None Type
         res = self.client().post(
@@ -128,6 +291,142 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "unprocessable entity")
         self.assertEqual("question" in data, False)
 
+        # Difficulty range with min above max
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 1},
+                "difficulty": {"min": 4, "max": 2},
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+        # Invalid difficulty curve
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 1},
+                "difficulty_curve": [],
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    def test_get_a_quiz_question_without_answer(self):
+        res = self.client().post(
+            "/api/v1/quizzes",
+            json={
+                "previous_questions": [],
+                "quiz_category": {"id": 1},
+                "include_answer": False,
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual("id" in data["question"], True)
+        self.assertEqual("answer" in data["question"], False)
+
+    # write test cases for POST /api/v1/quizzes/answer
+    def test_check_an_answer(self):
+        res = self.client().get("/api/v1/questions")
+        question = json.loads(res.data)["questions"][0]
+
+        # Same answer with different case and punctuation
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={
+                "question_id": question["id"],
+                "answer": "  " + question["answer"].upper() + "!",
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["correct"], True)
+        self.assertEqual(data["answer"], question["answer"])
+
+        # Typos are accepted up to the server's tolerance for this answer
+        allowed_typos = min(
+            self.app.config["ANSWER_MAX_DISTANCE"],
+            len(normalize_answer(question["answer"]))
+            // self.app.config["ANSWER_CHARS_PER_EDIT"],
+        )
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={
+                "question_id": question["id"],
+                "answer": question["answer"] + "x" * allowed_typos,
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["correct"], True)
+
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={
+                "question_id": question["id"],
+                "answer": question["answer"] + "x" * (allowed_typos + 1),
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["correct"], False)
+
+    def test_check_an_answer_ignores_stale_cached_answer(self):
+        res = self.client().get("/api/v1/questions")
+        question = json.loads(res.data)["questions"][0]
+
+        # e.g. cached before another process changed the answer
+        normalized_answers[question["id"]] = ("stale answer", "stale answer")
+
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={"question_id": question["id"], "answer": question["answer"]},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["correct"], True)
+
+    def test_422_check_an_answer_with_invalid_parameters(self):
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={"question_id": True, "answer": "Apollo 13"},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+        res = self.client().post("/api/v1/quizzes/answer", json={"question_id": 1})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    def test_404_check_an_answer_of_a_not_existing_question(self):
+        res = self.client().post(
+            "/api/v1/quizzes/answer",
+            json={"question_id": 1000000, "answer": "Apollo 13"},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
     # DONE: write test cases for /api/v1/category/<int:category_id>/questions
     def test_get_questions_in_category(self):
         res = self.client().get("/api/v1/categories/1/questions?page=1")
@@ -166,6 +465,40 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
 
+    def test_create_a_question_with_group_commit(self):
+        app = self.create_test_app(
+            {"GROUP_COMMIT": True, "GROUP_COMMIT_MAX_DELAY_MS": 1}
+        )
+        client = app.test_client()
+        writer = app.extensions["group_commit"]
+
+        # the writer thread starts with the first create, not in create_app
+        self.assertEqual(writer._thread is None, True)
+
+        res = client.post(
+            "/api/v1/questions",
+            json={
+                "question": "Who discovered penicillin?",
+                "answer": "Alexander Fleming",
+                "difficulty": 2,
+                "category": 1,
+            },
+        )
+        data = json.loads(res.data)
+        writer.close()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+
+        res = client.get("/api/v1/questions?searchTerm=discovered penicillin")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"] >= 1, True)
+
+        for question in data["questions"]:
+            client.delete("/api/v1/questions/{}".format(question["id"]))
+
     def test_422_create_a_question_with_invalid_parameters(self):
         # With missing question
         res = self.client().post(
@@ -257,6 +590,218 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data["success"], False)
 
+    # write test cases for POST /api/v1/batch
+    def test_batch_requests(self):
+        res = self.client().post(
+            "/api/v1/batch",
+            json={
+                "requests": [
+                    {"path": "/api/v1/categories"},
+                    {"method": "GET", "path": "/api/v1/questions?page=1"},
+                    {
+                        "method": "POST",
+                        "path": "/api/v1/quizzes",
+                        "body": {"previous_questions": [], "quiz_category": {"id": 1}},
+                    },
+                    {"path": "/api/v1/questions?page=10000"},
+                ]
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(data["responses"]), 4)
+        self.assertEqual(data["responses"][0]["status"], 200)
+        self.assertEqual("categories" in data["responses"][0]["body"], True)
+        self.assertEqual(data["responses"][1]["status"], 200)
+        self.assertEqual("questions" in data["responses"][1]["body"], True)
+        self.assertEqual(data["responses"][2]["status"], 200)
+        self.assertEqual("question" in data["responses"][2]["body"], True)
+        self.assertEqual(data["responses"][3]["status"], 404)
+        self.assertEqual(data["responses"][3]["body"]["success"], False)
+
+    def test_batch_recovers_from_a_failing_write(self):
+        res = self.client().post(
+            "/api/v1/batch",
+            json={
+                "requests": [
+                    {
+                        "method": "POST",
+                        "path": "/api/v1/questions",
+                        "body": {
+                            "question": "Which category does not exist?",
+                            "answer": "This one",
+                            "difficulty": 1,
+                            "category": 1000000,
+                        },
+                    },
+                    {"path": "/api/v1/categories"},
+                ]
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["responses"][0]["status"], 500)
+        self.assertEqual(data["responses"][1]["status"], 200)
+        self.assertEqual("categories" in data["responses"][1]["body"], True)
+
+    def test_422_batch_with_invalid_requests(self):
+        # Empty batch
+        res = self.client().post("/api/v1/batch", json={"requests": []})
+        self.assertEqual(res.status_code, 422)
+
+        # Nested batch
+        res = self.client().post(
+            "/api/v1/batch",
+            json={"requests": [{"method": "POST", "path": "/api/v1/batch"}]},
+        )
+        self.assertEqual(res.status_code, 422)
+
+        # Nested batch behind an escaped or decorated path
+        for path in ["/api/v1/%62atch", "/api/v1/batch#x"]:
+            res = self.client().post(
+                "/api/v1/batch",
+                json={
+                    "requests": [
+                        {
+                            "method": "POST",
+                            "path": path,
+                            "body": {"requests": [{"path": "/api/v1/categories"}]},
+                        }
+                    ]
+                },
+            )
+            self.assertEqual(res.status_code, 422)
+
+        # Path outside the API
+        res = self.client().post(
+            "/api/v1/batch", json={"requests": [{"path": "/static/index.html"}]}
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # write test cases for GET /api/v1/ready
+    def test_503_not_ready_before_warm_up(self):
+        res = self.client().get("/api/v1/ready")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["ready"], False)
+
+    def test_ready_after_warm_up(self):
+        warm_up(self.app)
+
+        res = self.client().get("/api/v1/ready")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["ready"], True)
+        self.assertEqual(data["warm_up_seconds"] >= 0, True)
+
+        # the app still serves requests after its connections were disposed
+        res = self.client().get("/api/v1/categories")
+        self.assertEqual(res.status_code, 200)
+
+    def test_warm_up_bypasses_admission_control(self):
+        # a burst of one request per worker would throttle warm-up otherwise
+        app = self.create_test_app({"WORKER_PROCESSES": 32})
+        warm_up(app)
+
+        self.assertEqual(app.extensions["warm_up"]["ready"], True)
+        self.assertEqual(app.extensions["admission"].stats()["clients"], 0)
+
+    # write test cases for admission control
+    def test_429_rate_limited_client(self):
+        app = self.create_test_app(
+            {"RATE_LIMIT_PER_SECOND": 0.01, "RATE_LIMIT_BURST": 2}
+        )
+        client = app.test_client()
+
+        for _ in range(2):
+            res = client.get("/api/v1/categories")
+            self.assertEqual(res.status_code, 200)
+
+        res = client.get("/api/v1/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "too many requests")
+        self.assertEqual(int(res.headers["Retry-After"]) >= 1, True)
+
+    def test_503_expensive_endpoint_over_concurrency_cap(self):
+        app = self.create_test_app({"EXPENSIVE_CONCURRENCY": 0})
+        client = app.test_client()
+
+        res = client.get("/api/v1/categories")
+        self.assertEqual(res.status_code, 200)
+
+        # Question pages without a search term are not capped
+        res = client.get("/api/v1/questions?page=1")
+        self.assertEqual(res.status_code, 200)
+
+        res = client.get("/api/v1/questions?searchTerm=What")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "service unavailable")
+        self.assertEqual("Retry-After" in res.headers, True)
+
+    def test_admission_limits_are_split_between_workers(self):
+        app = self.create_test_app(
+            {
+                "WORKER_PROCESSES": 4,
+                "RATE_LIMIT_PER_SECOND": 20,
+                "RATE_LIMIT_BURST": 40,
+                "EXPENSIVE_CONCURRENCY": 4,
+            }
+        )
+        admission = app.extensions["admission"]
+
+        self.assertEqual(admission.rate, 5)
+        self.assertEqual(admission.burst, 10)
+        self.assertEqual(admission.max_expensive, 1)
+
+    def test_admission_controller_refills_and_evicts_buckets(self):
+        now = [0.0]
+        admission = AdmissionController(
+            rate=1,
+            burst=1,
+            max_clients=2,
+            max_expensive=1,
+            expensive_endpoints=["find_questions"],
+            clock=lambda: now[0],
+        )
+
+        self.assertEqual(admission.admit("a", "find_categories"), (None, None))
+        self.assertEqual(admission.admit("a", "find_categories"), (429, 1))
+        now[0] += 1
+        self.assertEqual(admission.admit("a", "find_categories"), (None, None))
+
+        # Only the two most recently seen clients keep a bucket
+        admission.admit("b", "find_categories")
+        admission.admit("c", "find_categories")
+        self.assertEqual(admission.stats()["clients"], 2)
+
+        # Expensive slots are shared across clients until released
+        now[0] += 1
+        self.assertEqual(admission.admit("b", "find_questions"), (None, None))
+        self.assertEqual(admission.admit("c", "find_questions"), (503, 1))
+        admission.release("find_questions")
+        self.assertEqual(admission.admit("c", "find_questions"), (None, None))
+
+        # A shed request leaves the client's token in its bucket
+        now[0] += 1
+        self.assertEqual(admission.admit("b", "find_questions"), (503, 1))
+        self.assertEqual(admission.admit("b", "find_categories"), (None, None))
+        self.assertEqual(admission.admit("b", "find_categories"), (429, 1))
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":